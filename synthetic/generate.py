@@ -5,14 +5,16 @@ Generate synthetic data for testing
 import argparse
 from datetime import datetime
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import Iterable, Iterator, Tuple, Optional, Union
 
 import numpy as np
-from matplotlib import pyplot as plt
 from tqdm.auto import tqdm
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
-from synthetic.records import Registry
+from synthetic.records import Registry, TRIPS_SCHEMA
 from synthetic.state_machine import CRTPool
 
 
@@ -40,18 +42,25 @@ def initparser():
                             type=float, help='Replenishment rate', default=1)
     cli_parser.add_argument('-d', '--days',
                             type=int, help='Number of days to simulate', default=2000)
+    cli_parser.add_argument('--seed',
+                            type=int, help='Seed for the simulation random generator',
+                            default=42)
+    cli_parser.add_argument('--plot', action='store_true',
+                            help='Also save plots of the demand and the CRT pool')
 
     return cli_parser
 
 
-def generate(
+def generate(  # pylint: disable=too-many-arguments, too-many-positional-arguments
         n: int,
         T: int,  # pylint: disable=invalid-name
         shrinkage_rate: float,
         replenishment_rate: float,
-        demand: pd.DataFrame
+        demand: pd.DataFrame,
+        seed: Optional[int] = None,
+        streaming: bool = False
 ) -> Tuple[
-    pd.DataFrame, pd.DataFrame]:
+    Union[pd.DataFrame, Iterator[pa.RecordBatch]], pd.DataFrame]:
     """
     Generate synthetic data for testing
     :param n: number of records
@@ -59,14 +68,18 @@ def generate(
     :param shrinkage_rate: Shrinkage rate
     :param replenishment_rate: Replenishment rate (CRTs per day)
     :param demand: Demand time series
+    :param seed: Seed for the random generator driving the simulation
+    :param streaming: Return the trips as an iterator of pyarrow RecordBatches
 
     :return: A tuple of two pd.DataFrames:
         - The first one contains the registry of all recorded trips
         with trip_id, crt_id, start, end and state
+        (as RecordBatches with the same columns if `streaming`)
         - The second one contains the daily reports of the CRT pools
     """
 
     registry = Registry()
+    rng = np.random.default_rng(seed)
 
     daily_loss_rate = shrinkage_rate / (T * (1 - shrinkage_rate))
     pool = CRTPool(
@@ -75,17 +88,14 @@ def generate(
         daily_loss_rate=daily_loss_rate,
         start_date=demand.index.min(),
         replenishment_rate=replenishment_rate,
-        registry=registry
+        registry=registry,
+        rng=rng
     )
 
-    reports = []
-    for _, demand_value in tqdm(demand.iterrows(), total=len(demand)):
-        reports.append(pool.proceed(demand=int(demand_value['demand'])))
+    demand_values = demand['demand'].to_numpy(dtype=np.int64)
+    reports = pool.run(tqdm(demand_values, mininterval=0.5))
 
-    # for k, v in registry.registry.items():
-    #     print(k, v)
-
-    return registry.dump(), pd.DataFrame(reports, index=demand.index)
+    return registry.dump(streaming=streaming), pd.DataFrame(reports, index=demand.index)
 
 
 def generate_demand(n: int) -> pd.DataFrame:
@@ -105,24 +115,76 @@ def generate_demand(n: int) -> pd.DataFrame:
     monthly_amplitude = scale * np.random.randint(2, 5, size=n)
     yearly_amplitude = scale * np.random.randint(2, 20, size=n)
 
-    weekly_seasonality = weekly_amplitude * np.power(
-        np.sin(2 * np.pi * np.arange(n) / 7 + weekly_phase),
-        2
-    )
-    monthly_seasonality = monthly_amplitude * np.sin(2 * np.pi * np.arange(n) / 30 + monthly_phase)
-    yearly_seasonality = yearly_amplitude * np.sin(2 * np.pi * np.arange(n) / 365 + yearly_phase)
-
-    trend = scale * (25 + np.arange(n) / 100)
+    # Accumulate trend and seasonalities in place, to avoid one temporary per term
+    days = np.arange(n)
+    total = days / 100
+    total += 25
+    total *= scale
+    buffer = np.empty(n)
+    _add_seasonality(total, buffer, days, weekly_amplitude, 7, weekly_phase, squared=True)
+    _add_seasonality(total, buffer, days, monthly_amplitude, 30, monthly_phase)
+    _add_seasonality(total, buffer, days, yearly_amplitude, 365, yearly_phase)
 
     demand = pd.DataFrame(
         {
-            'demand': trend + weekly_seasonality + monthly_seasonality + yearly_seasonality
+            'demand': total
         },
         index=date_range
     )
     return demand
 
 
+def _add_seasonality(  # pylint: disable=too-many-arguments, too-many-positional-arguments
+        total: np.ndarray,
+        buffer: np.ndarray,
+        days: np.ndarray,
+        amplitude: np.ndarray,
+        period: int,
+        phase: float,
+        squared: bool = False
+):
+    """
+    Add `amplitude * sin(2 pi days / period + phase)` (optionally squared) to `total`
+    in place, using `buffer` as scratch space
+    """
+    np.multiply(2 * np.pi, days, out=buffer)
+    buffer /= period
+    buffer += phase
+    np.sin(buffer, out=buffer)
+    if squared:
+        np.square(buffer, out=buffer)
+    buffer *= amplitude
+    total += buffer
+
+
+def write_trips(batches: Iterable[pa.RecordBatch], target: Path) -> dict:
+    """
+    Stream batches of trips into a zstd-compressed parquet file
+    :param batches: Trips, as dumped by Registry.dump(streaming=True)
+    :param target: Path of the parquet file
+    :return: Summary statistics of the trips gathered while writing them:
+        the number of trips, the number of trips in each final state and
+        the total duration in days of the finished ones
+    """
+    stats = {'trips': 0, 'home': 0, 'rented': 0, 'lost': 0, 'duration': 0.}
+    with pq.ParquetWriter(target, TRIPS_SCHEMA,
+                          compression='zstd', compression_level=3) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+            stats['trips'] += batch.num_rows
+            for count in batch.column('state').value_counts().to_pylist():
+                stats[count['values']] += count['counts']
+            # pyarrow.compute functions are generated at import time
+            # pylint: disable=no-member
+            # In float days, as summing nanoseconds would overflow
+            durations = pc.subtract(batch.column('end'), batch.column('start'))
+            nanoseconds = pc.cast(pc.cast(durations, pa.int64()), pa.float64(), safe=False)
+            days = pc.divide(nanoseconds, pd.Timedelta(days=1).value)
+            stats['duration'] += pc.sum(days).as_py() or 0.
+    return stats
+
+
 def main(path: Optional[Path] = None, **kwargs):
     """
     Main function to generate synthetic data
@@ -135,44 +197,71 @@ def main(path: Optional[Path] = None, **kwargs):
     shrinkage_rate = kwargs["shrinkage_rate"]
     replenishment_rate = kwargs["replenish_rate"]
     days = kwargs["days"]
+    seed = kwargs["seed"]
 
     demand = generate_demand(days)
-    ax = demand.plot(figsize=(15, 5), title="Daily Demand", legend=False)
-    ax.set_ylim(0, 20)
-    ax.set_xlabel("Date")
-    ax.get_figure().savefig(path / "demand.png")
-    demand.to_parquet(path / "demand.parquet")
+    demand.to_parquet(path / "demand.parquet", compression='zstd')
     trips, df = generate(
         n=n,
         T=T,
         shrinkage_rate=shrinkage_rate,
         replenishment_rate=replenishment_rate,
-        demand=demand
+        demand=demand,
+        seed=seed,
+        streaming=True
     )
+    stats = write_trips(trips, path / "trips.parquet")
+
     print("\nSummary")
     print("-----------------------------------")
-    print(f"Total trips generated: {len(trips)}")
-    print(f"Total CRTs lost: {len(trips[trips['state'] == 'lost'])}")
-    print(f"Final CRTs rented: {len(trips[trips['state'] == 'rented'])}")
-    print(f"Final CRTs pool (home + rented): {len(trips[trips['state'].isin(['home', 'rented'])])}")
+    print(f"Total trips generated: {stats['trips']}")
+    print(f"Total CRTs lost: {stats['lost']}")
+    print(f"Final CRTs rented: {stats['rented']}")
+    print(f"Final CRTs pool (home + rented): {stats['home'] + stats['rented']}")
+    # Only trips back home have an end date
     print(f"Average trip length: "
-          f"{(trips['end'] - trips['start']).mean() / pd.Timedelta(days=1):.2f} days")
-    print(f"Shrinkage Rate: {(trips['state'] == 'lost').mean():.2%}")
+          f"{_ratio(stats['duration'], stats['home']):.2f} days")
+    print(f"Shrinkage Rate: {_ratio(stats['lost'], stats['trips']):.2%}")
     print("-----------------------------------")
 
-    trips.to_parquet(path / "trips.parquet")
+    df.to_parquet(path / "daily_reports.parquet", compression='zstd')
+
+    if kwargs.get("plot", False):
+        save_plots(demand, df, path)
+
+
+def _ratio(numerator: float, denominator: float) -> float:
+    """
+    Ratio of two summary statistics, NaN if there is nothing to divide by
+    """
+    return numerator / denominator if denominator else float('nan')
+
+
+def save_plots(demand: pd.DataFrame, reports: pd.DataFrame, path: Path):
+    """
+    Save the plots of the daily demand and of the CRT pool evolution
+    :param demand: Demand time series
+    :param reports: Daily reports of the CRT pool
+    :param path: Output path for the plots
+    """
+    # Only imported when plotting, so that headless runs don't pay for it
+    from matplotlib import pyplot as plt  # pylint: disable=import-outside-toplevel
+
+    ax = demand.plot(figsize=(15, 5), title="Daily Demand", legend=False)
+    ax.set_ylim(0, 20)
+    ax.set_xlabel("Date")
+    ax.get_figure().savefig(path / "demand.png")
 
     fig, ax = plt.subplots(2, 1, sharex=True, figsize=(12, 8))
 
     demand.plot(ax=ax[0])
-    df.plot.area(ax=ax[1], stacked=True, legend=True)
+    reports.plot.area(ax=ax[1], stacked=True, legend=True)
     ax[0].set_title("Demand")
     ax[1].set_title("CRT Pool")
     ax[1].set_ylabel("Number of CRTs")
     ax[1].set_xlabel("Date")
     plt.tight_layout()
 
-    df.to_parquet(path / "daily_reports.parquet")
     fig.get_figure().savefig(path / "output.png")
 
 
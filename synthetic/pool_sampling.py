@@ -2,31 +2,52 @@
 Implements different pool sampling strategies
 """
 
+from itertools import islice
 from typing import Optional
 
 import numpy as np
 
+__all__ = ['PoolSampling', 'Poisson', 'LogNormal', 'Scrambling', 'LIFO', 'FIFO', 'Sink']
+
 
 class PoolSampling:
     """
     Implements a pool such that elements are drawn according to a specific logic
     """
 
-    def __init__(self):
-        self.pool = np.array([], dtype=int)
+    def __init__(self, rng: Optional[np.random.Generator] = None):
+        self.pool = set()
+        self._rng = rng
+
+    @property
+    def rng(self) -> np.random.Generator:
+        """
+        Random generator of the pool, only created when first needed
+        since not all the pools draw at random
+        """
+        if self._rng is None:
+            self._rng = np.random.default_rng()
+        return self._rng
 
     def ingress(self, idx: int):
         """
         Add element to the pool
         """
-        self.pool = np.append(self.pool, idx)
+        self.pool.add(idx)
 
     def egress(self, idx: int):
         """
         Removed from the pool
         """
         # remove id from pool
-        self.pool = self.pool[self.pool != idx]
+        self.pool.discard(idx)
+
+    def egress_many(self, idx: np.ndarray):
+        """
+        Remove several elements from the pool, as if they egressed one by one
+        """
+        for i in idx:
+            self.egress(i)
 
     def remove(self, idx: int):
         """
@@ -41,6 +62,12 @@ class PoolSampling:
         and return a different number of elements according to their own logic
         """
 
+    def as_array(self) -> np.ndarray:
+        """
+        Materialize the elements of the pool as an integer array
+        """
+        return np.fromiter(self.pool, dtype=np.int64, count=len(self.pool))
+
     def __repr__(self):
         return f"{self.__class__.__name__}({self.pool})"
 
@@ -50,42 +77,76 @@ class Poisson(PoolSampling):
     Implements a pool where elements are drawn according to a Poisson process (memoryless)
     """
 
-    def __init__(self, rate):
-        super().__init__()
+    def __init__(self, rate, rng: Optional[np.random.Generator] = None):
+        super().__init__(rng)
         self.rate = rate
 
     def draw(self, n: Optional[int]):
-        drawn = np.random.choice([True, False],
-                                 p=[self.rate, 1 - self.rate],
-                                 size=len(self.pool), replace=True)
-        return self.pool[drawn]
+        pool = self.as_array()
+        drawn = self.rng.random(pool.size) < self.rate
+        return pool[drawn]
 
 
-class LogNormal(PoolSampling):
+class LogNormal(PoolSampling):  # pylint: disable=too-many-instance-attributes
     """
     Implements a pool where elements are drawn according to a Log-Normal distribution
     """
 
-    def __init__(self, mean, std):
-        super().__init__()
-        self.pool = {}
+    # Number of durations drawn from the random generator at once
+    block_size = 4096
+
+    def __init__(self, mean, std, rng: Optional[np.random.Generator] = None):
+        super().__init__(rng)
         self.mean = mean
         self.std = std
 
+        # Durations drawn ahead of time, consumed from _dur_idx on
+        self._dur_cache = np.empty(0)
+        self._dur_idx = 0
+
+        # Remaining steps of each element, stored contiguously so that they can all be
+        # updated at once. The pool maps each element to its slot in these arrays
+        self.pool = {}
+        self.ids = np.empty(16, dtype=np.int64)
+        self.steps = np.empty(16, dtype=np.float64)
+        self.size = 0
+
     def ingress(self, idx: int):
+        if self.size == self.ids.size:
+            # Grow geometrically to keep insertions amortized O(1)
+            self.ids = np.resize(self.ids, 2 * self.size)
+            self.steps = np.resize(self.steps, 2 * self.size)
+
         # initialize the counter for each element
-        # Draw the number of steps from a Log-Normal distribution
-        n = np.log(np.random.lognormal(self.mean, self.std))
+        self.pool[idx] = self.size
+        self.ids[self.size] = idx
+        self.steps[self.size] = self._next_duration()
+        self.size += 1
 
-        self.pool[idx] = n
+    def _next_duration(self) -> float:
+        """
+        Draw the number of steps of an element from a Log-Normal distribution,
+        refilling the cache of pre-drawn durations when it runs out
+        """
+        if self._dur_idx == self._dur_cache.size:
+            self._dur_cache = np.log(self.rng.lognormal(self.mean, self.std, size=self.block_size))
+            self._dur_idx = 0
+        duration = self._dur_cache[self._dur_idx]
+        self._dur_idx += 1
+        return duration
 
     def egress(self, idx: int):
-        # remove id from pool
-        self.pool.pop(idx)
+        # remove id from pool, moving the last element into its slot
+        slot = self.pool.pop(idx)
+        self.size -= 1
+        if slot != self.size:
+            last = int(self.ids[self.size])
+            self.ids[slot] = last
+            self.steps[slot] = self.steps[self.size]
+            self.pool[last] = slot
 
     def remove(self, idx: int):
-        # remove id from pool
-        self.pool.pop(idx)
+        self.egress(idx)
 
     def draw(self, n: Optional[int]):
         # *******************************
@@ -93,11 +154,11 @@ class LogNormal(PoolSampling):
         # *******************************
 
         # Return list of elements that are due to transition
-        drawn = [id for id, steps in self.pool.items() if steps < 0]
+        steps = self.steps[:self.size]
+        drawn = self.ids[:self.size][steps < 0]
 
         # update the counter for each element
-        for idx in self.pool:
-            self.pool[idx] -= 1
+        steps -= 1
 
         return drawn
 
@@ -109,9 +170,11 @@ class Scrambling(PoolSampling):
     """
 
     def draw(self, n: Optional[int]):
-        if n > len(self.pool):
-            return self.pool
-        return np.random.choice(self.pool, n)
+        pool = self.as_array()
+        if n > pool.size:
+            return pool
+        # Same as choice with replacement, without its argument checks
+        return pool[self.rng.integers(0, pool.size, size=n)]
 
 
 class LIFO(PoolSampling):
@@ -119,9 +182,21 @@ class LIFO(PoolSampling):
     Implements a pool such that elements are drawn according to a Last-In-First-Out policy
     """
 
+    def __init__(self, rng: Optional[np.random.Generator] = None):
+        super().__init__(rng)
+        # dicts keep insertion order, which is what LIFO needs
+        self.pool = {}
+
+    def ingress(self, idx: int):
+        self.pool[idx] = None
+
+    def egress(self, idx: int):
+        self.pool.pop(idx, None)
+
     def draw(self, n: Optional[int]):
-        drawn = self.pool[len(self.pool) - n:] if n <= len(self.pool) else self.pool
-        return drawn
+        # Walk back from the most recent element, only as far as needed
+        drawn = np.fromiter(islice(reversed(self.pool), n), dtype=np.int64)
+        return drawn[::-1]
 
 
 class FIFO(PoolSampling):
@@ -130,34 +205,145 @@ class FIFO(PoolSampling):
     but only after a given delay
     """
 
-    def __init__(self, delay=0):
+    def __init__(self, delay=0, capacity=16):
         super().__init__()
-        self.pool = {k: np.array([]) for k in range(delay + 1)}
         self.delay = delay
 
+        # One row of element ids per remaining day of delay, filled up to _len.
+        # Row 0 holds the elements already due; the other rows form a ring that
+        # rotates as days go by, where the next batch to become due is at 1 + _head
+        self._buf = np.empty((delay + 1, capacity), dtype=np.int64)
+        # Plain ints, which are cheaper to read and store one at a time than numpy scalars
+        self._len = [0] * (delay + 1)
+        self._head = 0
+        # Rows of the next batch to become due, and of the batch just ingressed,
+        # updated whenever the ring rotates
+        self._slot_front = self._row(1) if delay else 0
+        self._slot_back = self._row(delay)
+        self.pool = _FIFOView(self)
+
     def ingress(self, idx: int):
-        self.pool[self.delay] = np.append(self.pool[self.delay], idx)
+        row = self._slot_back
+        n = self._len[row]
+        if n == self._buf.shape[1]:
+            self._grow(n + 1)
+        self._buf[row, n] = idx
+        self._len[row] = n + 1
 
     def egress(self, idx: int):
-        assert idx in self.pool[0], f"Element {idx} is not due to egress"
-        self.pool[0] = self.pool[0][self.pool[0] != idx]
+        found = self._discard(0, idx)
+        assert found, f"Element {idx} is not due to egress"
+
+    def egress_many(self, idx: np.ndarray):
+        # Compact the due row in a single pass
+        due = self._buf[0, :self._len[0]]
+        leaving = np.isin(due, idx)
+        assert np.count_nonzero(leaving) == len(idx), f"Some of {idx} are not due to egress"
+        kept = due[~leaving]
+        self._buf[0, :kept.size] = kept
+        self._len[0] = kept.size
 
     def remove(self, idx: int):
-        for k in range(self.delay + 1):
-            self.pool[k] = self.pool[k][self.pool[k] != idx]
+        # Drop every occurrence of the element, only looking at the filled part of each row
+        for row, n in enumerate(self._len):
+            values = self._buf[row, :n]
+            kept = values[values != idx]
+            if kept.size < n:
+                self._buf[row, :kept.size] = kept
+                self._len[row] = kept.size
 
     def draw(self, n: Optional[int]):
-        drawn = self.pool[0][:n] if n <= len(self.pool[0]) else self.pool[0]
+        drawn = self._buf[0, :self._len[0]][:n].copy()
 
         # Move all elements one step forward
         if self.delay > 0:
-            # Keep the elements already due, but add next batch
-            self.pool[0] = np.concat([self.pool[0], self.pool[1]])
-            for k in range(1, self.delay):
-                self.pool[k] = self.pool[k + 1]
-            self.pool[self.delay] = np.array([])
+            self.advance()
         return drawn
 
+    def advance(self):
+        """
+        Rotate the ring one day: the next batch becomes due, joining the elements already due
+        """
+        row = self._slot_front
+        self._set(0, self._buf[row, :self._len[row]], keep=self._len[0])
+        # The emptied row becomes the last one of the ring
+        self._len[row] = 0
+        self._head = (self._head + 1) % self.delay
+        self._slot_front = self._row(1)
+        self._slot_back = row
+
+    def _row(self, i: int) -> int:
+        """
+        Physical row of the bucket with i remaining days of delay
+        """
+        if i == 0:
+            return 0
+        return 1 + (self._head + i - 1) % self.delay
+
+    def _grow(self, capacity: int):
+        """
+        Make room for at least `capacity` elements per row, doubling the current capacity
+        """
+        buf = np.empty((self.delay + 1, max(capacity, 2 * self._buf.shape[1])), dtype=np.int64)
+        buf[:, :self._buf.shape[1]] = self._buf
+        self._buf = buf
+
+    def _set(self, row: int, values, keep: int = 0):
+        """
+        Write `values` into a row after its first `keep` elements, dropping the rest
+        """
+        end = keep + len(values)
+        if end > self._buf.shape[1]:
+            self._grow(end)
+        self._buf[row, keep:end] = values
+        self._len[row] = end
+
+    def _discard(self, row: int, idx: int) -> bool:
+        """
+        Remove an element from a row, keeping the order of the rest. Return whether it was found
+        """
+        found = np.flatnonzero(self._buf[row, :self._len[row]] == idx)
+        if found.size == 0:
+            return False
+        self._delete(row, int(found[0]))
+        return True
+
+    def _delete(self, row: int, pos: int):
+        """
+        Delete the element at position `pos` of a row, shifting the ones after it.
+        Unlike swapping in the last element, this keeps the elements in arrival order
+        """
+        n = self._len[row]
+        self._buf[row, pos:n - 1] = self._buf[row, pos + 1:n]
+        self._len[row] = n - 1
+
+
+class _FIFOView:
+    """
+    Sequence over the buckets of a FIFO pool, from the elements already due
+    to those with the longest remaining delay. Assigning to a position
+    replaces the contents of that bucket
+    """
+
+    def __init__(self, fifo: FIFO):
+        self._fifo = fifo
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        row = self._fifo._row(i)  # pylint: disable=protected-access
+        return self._fifo._buf[row, :self._fifo._len[row]]  # pylint: disable=protected-access
+
+    def __setitem__(self, i: int, values):
+        self._fifo._set(self._fifo._row(i), values)  # pylint: disable=protected-access
+
+    def __len__(self):
+        return self._fifo.delay + 1
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __repr__(self):
+        return repr([bucket.tolist() for bucket in self])
+
 
 class Sink(PoolSampling):
     """
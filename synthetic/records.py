@@ -2,26 +2,45 @@
 Data models for trips and a registry to keep track of them
 """
 
+import itertools
+from collections import defaultdict, deque
 from dataclasses import dataclass
 from datetime import date
-from typing import List, Tuple
+from typing import Dict, Iterator, List, NamedTuple, Tuple
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+
+__all__ = ['AutoIncrement', 'Trip', 'TripPool', 'TripRecord', 'Registry', 'TRIPS_SCHEMA']
+
+# Schema of the trips dumped by the Registry
+TRIPS_SCHEMA = pa.schema([
+    ('trip_id', pa.int64()),
+    ('crt_id', pa.int64()),
+    ('start', pa.timestamp('ns')),
+    ('end', pa.timestamp('ns')),
+    ('state', pa.string()),
+])
 
 
 class AutoIncrement:  # pylint: disable=too-few-public-methods
     """
     Implement an auto-incrementing id
     """
+    __slots__ = ('id',)
     id: int
-    _id_counter = 1
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Every subclass counts its own ids
+        cls._next_id = itertools.count(1).__next__
 
     def __post_init__(self):
-        self.id = self.__class__._id_counter  # pylint: disable=protected-access
-        self.__class__._id_counter += 1
+        self.id = type(self)._next_id()
 
 
-@dataclass
+@dataclass(slots=True)
 class Trip(AutoIncrement):
     """
     A trip contains a sequence of state transitions, from the moment a
@@ -32,42 +51,135 @@ class Trip(AutoIncrement):
     states: List[Tuple[str, date]]
 
 
-class Registry:
+class TripPool:
+    """
+    Free-list of finished trips, recycled for new ones to save their allocation
+    """
+    _free = deque()
+
+    @classmethod
+    def acquire(cls, crt_id: int, created_at: date, states: List[Tuple[str, date]]) -> Trip:
+        """
+        Return a trip with a new id, reusing a released one if available
+        """
+        if not cls._free:
+            return Trip(crt_id=crt_id, created_at=created_at, states=states)
+        trip = cls._free.pop()
+        trip.crt_id = crt_id
+        trip.created_at = created_at
+        trip.states = states
+        trip.__post_init__()
+        return trip
+
+    @classmethod
+    def release(cls, trip: Trip):
+        """
+        Give back a trip that won't be updated nor read anymore
+        """
+        cls._free.append(trip)
+
+
+class TripRecord(NamedTuple):
+    """
+    Read-only view of a trip stored in a Registry
+    """
+    id: int
+    crt_id: int
+    states: List[Tuple[str, pd.Timestamp]]
+
+
+class Registry:  # pylint: disable=too-many-instance-attributes
     """
-    A registry to keep track of all recorded trips
+    A registry to keep track of all recorded trips, stored as a columnar table
+    with one row per trip, in the order they were first registered
     """
-    def __init__(self):
-        self.registry = {}
+    def __init__(self, capacity: int = 1024):
+        self._trip_ids = np.empty(capacity, dtype=np.int64)
+        self._crt_ids = np.empty(capacity, dtype=np.int64)
+        self._starts = np.empty(capacity, dtype='datetime64[ns]')
+        # Latest state of each trip, and the day it was reached
+        self._last_states = np.empty(capacity, dtype=object)
+        self._last_days = np.empty(capacity, dtype='datetime64[ns]')
+        self._n = 0
+        # Row of each trip id
+        self._rows = {}
+        # Ids of the trips of each CRT, in the order they were registered
+        self._by_crt = defaultdict(list)
 
     def register(self, trip: Trip):
         """
-        Register a trip in the registry
+        Register a trip in the registry, or update it if it was already registered
         """
-        self.registry[trip.id] = trip
+        row = self._rows.get(trip.id)
+        if row is None:
+            row = self._n
+            if row == self._trip_ids.size:
+                self._grow()
+            self._rows[trip.id] = row
+            self._n += 1
+            self._trip_ids[row] = trip.id
+            self._crt_ids[row] = trip.crt_id
+            self._starts[row] = trip.states[0][1]
+            self._by_crt[trip.crt_id].append(trip.id)
+        self._last_states[row], self._last_days[row] = trip.states[-1]
 
-    def __getitem__(self, item):
-        return self.registry[item]
+    def trips_for(self, crt_id: int) -> List[int]:
+        """
+        Return the ids of the trips of a CRT, in the order they were registered
+        """
+        return list(self._by_crt.get(crt_id, []))
+
+    def _grow(self):
+        """
+        Double the capacity of the table, to keep registrations amortized O(1)
+        """
+        capacity = max(2 * self._trip_ids.size, 1)
+        self._trip_ids = np.resize(self._trip_ids, capacity)
+        self._crt_ids = np.resize(self._crt_ids, capacity)
+        self._starts = np.resize(self._starts, capacity)
+        self._last_states = np.resize(self._last_states, capacity)
+        self._last_days = np.resize(self._last_days, capacity)
+
+    def __getitem__(self, item) -> TripRecord:
+        row = self._rows[item]
+        # Trips start when a CRT is rented
+        states = [('rented', pd.Timestamp(self._starts[row]))]
+        if self._last_states[row] != 'rented':
+            states.append((self._last_states[row], pd.Timestamp(self._last_days[row])))
+        return TripRecord(id=item, crt_id=int(self._crt_ids[row]), states=states)
+
+    def __len__(self):
+        return self._n
 
     def __repr__(self):
-        return f"Registry({self.registry})"
+        return f"Registry({self._n} trips)"
+
+    def dump(self, streaming: bool = False, batch_size: int = 100_000):
+        """
+        Return a DataFrame with all the trips, their start and end dates (only if they have ended).
+        With `streaming`, return instead an iterator of pyarrow RecordBatches with `batch_size`
+        trips each, so that they can be written out without materializing all of them at once
+        """
+        if streaming:
+            return self._dump_batches(batch_size)
+        return pd.DataFrame(self._columns(0, self._n))
+
+    def _dump_batches(self, batch_size: int) -> Iterator[pa.RecordBatch]:
+        for start in range(0, self._n, batch_size):
+            stop = min(start + batch_size, self._n)
+            yield pa.RecordBatch.from_pydict(self._columns(start, stop), schema=TRIPS_SCHEMA)
 
-    def dump(self):
+    def _columns(self, start: int, stop: int) -> Dict[str, np.ndarray]:
         """
-        Return a DataFrame with all the trips, their start and end dates (only if they have ended)
+        Dump columns of the trips in rows [start, stop)
         """
-        df = pd.DataFrame(
-            [
-                {
-                    'trip_id': k,
-                    'crt_id': v.crt_id,
-                    'start': v.states[0][1],
-                    'end': v.states[-1][1] if v.states[-1][0] == 'home' else None,
-                    'state': v.states[-1][0]
-                }
-                for k, v in self.registry.items()
-            ]
-        )
-        df['start'] = pd.to_datetime(df['start'])
-        df['end'] = pd.to_datetime(df['end'])
-
-        return df
+        last_states = self._last_states[start:stop]
+        ends = np.where(last_states == 'home',
+                        self._last_days[start:stop], np.datetime64('NaT', 'ns'))
+        return {
+            'trip_id': self._trip_ids[start:stop].copy(),
+            'crt_id': self._crt_ids[start:stop].copy(),
+            'start': self._starts[start:stop].copy(),
+            'end': ends,
+            'state': last_states.copy()
+        }
@@ -4,34 +4,43 @@ of assets that keeps track of their states and simulates their evolution
 """
 
 import datetime
+import itertools
 from datetime import date
+from typing import Dict, Optional
 
 import numpy as np
 
-from transitions import Machine
-
 from synthetic.pool_sampling import FIFO, Sink, LogNormal
-from synthetic.records import AutoIncrement, Trip, Registry
+from synthetic.records import Registry, TripPool
 
 states = ['home', 'rented', 'lost']
 
+# Integer codes of the states, as stored in the CRTPool arrays
+HOME, RENTED, LOST = range(len(states))
+
+# Triggers of the CRT state machine, mapped to their (source, dest) states
+TRANSITIONS = {
+    'rent': ('home', 'rented'),
+    'recall': ('rented', 'home'),
+}
+
+# Source of CRT ids, shared by all the pools
+_CRT_IDS = itertools.count(1)
+
 
-class CRT(Machine, AutoIncrement):
+class CRT:  # pylint: disable=too-many-instance-attributes
     """
-    Implements a simple state machine for a crate rental system
+    Implements a simple state machine for a crate rental system.
+    Once added to a CRTPool, its state is stored in the state array of the pool
     """
     counter = 0
 
     def __init__(self, created_at=date, reporting_callback=None):
-        super().__init__(
-            states=states,
-            transitions=[
-                {'trigger': 'rent', 'source': 'home', 'dest': 'rented'},
-                {'trigger': 'recall', 'source': 'rented', 'dest': 'home'},
-                {'trigger': 'lose', 'source': 'rented', 'dest': 'lost'},
-            ],
-            initial='home'
-        )
+        self._state = 'home'
+        self._pool = None
+        self._idx = None
+        # Only trips reported to a Registry, which copies them, can be reused
+        self._recycle_trips = False
         self.created_at = created_at
         self.trip = None
 
@@ -41,23 +50,45 @@ class CRT(Machine, AutoIncrement):
         else:
             self.reporting_callback = lambda x: x
 
-        # Need to autoincrement manually because it's not a dataclass
-        self.id = self._id_counter
-        CRT._id_counter += 1
+        self.id = next(_CRT_IDS)
+
+    @property
+    def state(self) -> str:
+        """
+        Current state of the CRT
+        """
+        if self._pool is None:
+            return self._state
+        return states[self._pool.states[self._idx]]
+
+    @state.setter
+    def state(self, value: str):
+        if self._pool is None:
+            self._state = value
+        else:
+            self._pool.states[self._idx] = states.index(value)
+
+    def bind(self, pool: 'CRTPool', idx: int):
+        """
+        Keep the state of the CRT in slot `idx` of the state array of `pool`
+        """
+        pool.states[idx] = states.index(self.state)
+        self._pool = pool
+        self._idx = idx
+        self._recycle_trips = self.reporting_callback == pool.registry.register
 
     def next(self, day: date):
         """
         Proceed to the next natural state
         """
         if self.state == 'home':
-            self.trip = Trip(crt_id=self.id, created_at=day, states=[('rented', day)])
+            self.trip = TripPool.acquire(crt_id=self.id, created_at=day, states=[('rented', day)])
             self.reporting_callback(self.trip)
             self.rent()
         elif self.state == 'rented':
             # Terminate trip
             self.trip.states.append(('home', day))
-            self.reporting_callback(self.trip)
-            self.trip = None
+            self._end_trip()
             self.recall()
         else:
             self.lose(day)
@@ -67,13 +98,47 @@ class CRT(Machine, AutoIncrement):
         Trigger an asset loss on date `day`
         """
         self.trip.states.append(('lost', day))
+        self._end_trip()
         self.to_lost()
 
+    def _end_trip(self):
+        """
+        Report the finished trip. If it was reported to the registry of the pool,
+        which keeps a copy of it, give it back for reuse
+        """
+        trip, self.trip = self.trip, None
+        self.reporting_callback(trip)
+        if self._recycle_trips:
+            TripPool.release(trip)
+
+    def rent(self):
+        """
+        Send the CRT out on a trip
+        """
+        self._trigger('rent')
+
+    def recall(self):
+        """
+        Bring the CRT back home from its trip
+        """
+        self._trigger('recall')
+
+    def to_lost(self):
+        """
+        Mark the CRT as lost, regardless of its current state
+        """
+        self.state = 'lost'
+
+    def _trigger(self, trigger: str):
+        source, dest = TRANSITIONS[trigger]
+        assert self.state == source, f"Can't {trigger} a CRT in state '{self.state}'"
+        self.state = dest
+
     def __repr__(self):
         return f"CRT(id={self.id}, state={self.state})"
 
 
-class CRTPool:
+class CRTPool:  # pylint: disable=too-many-instance-attributes
     """
     Implements a pool of assets that keeps track of their states and simulates their evolution
     """
@@ -84,13 +149,19 @@ class CRTPool:
             daily_loss_rate,
             replenishment_rate,
             start_date,
-            registry=None
+            registry=None,
+            rng=None
     ):
         if registry is None:
             self.registry = Registry()
         else:
             self.registry = registry
 
+        if rng is None:
+            self.rng = np.random.default_rng()
+        else:
+            self.rng = rng
+
         self.pool = []
         self.mean_trip_duration = mean_trip_duration
         self.shrinkage_rate = daily_loss_rate
@@ -101,60 +172,137 @@ class CRTPool:
         # Can be Markovian, FIFO, LIFO, Constant
         self.state_pools = {
             'home': FIFO(delay=7),
-            'rented': LogNormal(mean_trip_duration, mean_trip_duration / 2),
+            'rented': LogNormal(mean_trip_duration, mean_trip_duration / 2, rng=self.rng),
             'lost': Sink()
         }
 
+        # Struct-of-arrays mirror of the pool, so that the daily update can select
+        # crates with vectorized masks and only touch the CRTs that transition
+        self.ids = np.empty(n_crates, dtype=np.int64)
+        self.states = np.empty(n_crates, dtype=np.int8)
+        # Number of crates in each state code, updated on every transition
+        self.counts = np.zeros(len(states), dtype=np.int64)
+
         # Create n instances of the CRT state machine
         for _ in range(n_crates):
-            crt = CRT(reporting_callback=self.registry.register)
-            self.state_pools[crt.state].ingress(crt.id)
-            self.pool.append(crt)
+            self.add_crt(CRT(reporting_callback=self.registry.register))
+
+    def run(self, demand: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Run the simulation for as many days as values in `demand`,
+        drawing the number of new CRTs of every day at once
+        :param demand: Daily demand
+        :return: The number of crates in each state at the end of each day
+        """
+        replenishments = self.rng.poisson(self.replenishment_rate, size=len(demand))
+        counts = np.empty((len(demand), len(states)), dtype=np.int64)
+        for day, (demand_value, replenishment) in enumerate(zip(demand, replenishments)):
+            self._step(int(demand_value), int(replenishment))
+            counts[day] = self.counts
+        return dict(zip(states, counts.T))
+
+    def proceed(self, demand: int, replenishment: Optional[int] = None):
+        """
+        Proceed one day in the simulation with the provided demand.
+        The number of new CRTs added to the pool can be provided with `replenishment`,
+        otherwise it is drawn from a Poisson distribution with the replenishment rate
+        """
+        if replenishment is None:
+            replenishment = self.rng.poisson(self.replenishment_rate)
+        self._step(demand, replenishment)
+
+        # At the end, report the number of crates in each state
+        return self.report()
+
+    def proceed_until(self, predicate_state: str, crt_idx: int, demand: int,
+                      max_days=10_000) -> bool:
+        """
+        Proceed day by day with the provided demand until the CRT at position `crt_idx`
+        of the pool is in `predicate_state`, for at most `max_days` days.
+        :return: Whether the CRT reached `predicate_state`
+        """
+        code = states.index(predicate_state)
+        for _ in range(max_days):
+            if self.states[crt_idx] == code:
+                return True
+            self._step(demand, self.rng.poisson(self.replenishment_rate))
+        return bool(self.states[crt_idx] == code)
 
-    def proceed(self, demand: int):
+    def _step(self, demand: int, replenishment: int):
         """
-        Proceed one day in the simulation with the provided demand
+        Simulate one day with the provided demand, adding `replenishment` new CRTs to the pool
         """
         # These are the CRTs that will transition out of each pool
         requests = {
             state: self.state_pools[state].draw(demand) for state in states
         }
 
-        for crt in self.pool:
-            source_pool = self.state_pools[crt.state]
-
-            if crt.state in ['rented']:
-                # Randomly lose some crates
-                if np.random.rand() < self.shrinkage_rate:
-                    source_pool.remove(crt.id)
-                    crt.lose(self.date)  # Will never make it back to 'incoming'
-                    target_pool = self.state_pools['lost']
-                    target_pool.ingress(crt.id)
-                    continue
-
-            if crt.id in requests[crt.state]:
-                # Time to move on
-                source_pool.egress(crt.id)
-                crt.next(self.date)
-                target_pool = self.state_pools[crt.state]
-                target_pool.ingress(crt.id)
+        self._lose_crates()
+        self._move_crates(requests)
 
         # Add new CRTs to the pool
-        # Chose according to a poisson, how many new CRTs will be added
-        n = np.random.poisson(self.replenishment_rate)
-        for _ in range(n):
+        for _ in range(replenishment):
             crt = CRT(self.date, reporting_callback=self.registry.register)
             self.add_crt(crt)
 
         self.date += datetime.timedelta(days=1)
 
-        # At the end, report the number of crates in each state
-        return self.report()
+    def _lose_crates(self):
+        """
+        Randomly lose some crates, drawing once for all the rented ones
+        """
+        codes = self.states[:len(self.pool)]
+        rented = np.flatnonzero(codes == RENTED)
+        lost = rented[self.rng.random(rented.size) < self.shrinkage_rate]
+        for i in lost:
+            crt = self.pool[i]
+            self.state_pools['rented'].remove(crt.id)
+            crt.lose(self.date)  # Will never make it back to 'incoming'
+            self.state_pools['lost'].ingress(crt.id)
+        self.counts[RENTED] -= lost.size
+        self.counts[LOST] += lost.size
+
+    def _move_crates(self, requests: Dict[str, np.ndarray]):
+        """
+        Move the crates drawn out of each state pool on to their next state
+        """
+        n = len(self.pool)
+        codes = self.states[:n]
+
+        # Positions of the drawn crates that are still in the state they were drawn from
+        # (i.e. skipping those that have just been lost), matching (id, state) pairs
+        # encoded as single keys
+        drawn = [np.asarray(requests[state], dtype=np.int64) for state in states]
+        sources = np.repeat(np.arange(len(states)), [len(d) for d in drawn])
+        drawn_keys = np.concatenate(drawn) * len(states) + sources
+        moving = np.flatnonzero(np.isin(self.ids[:n] * len(states) + codes, drawn_keys))
+
+        source_codes = codes[moving]
+        for code, state in enumerate(states):
+            self.state_pools[state].egress_many(self.ids[moving[source_codes == code]])
+
+        for i in moving:
+            # Time to move on
+            crt = self.pool[i]
+            crt.next(self.date)
+            self.state_pools[crt.state].ingress(crt.id)
+
+        self.counts += np.bincount(codes[moving], minlength=len(states))
+        self.counts -= np.bincount(source_codes, minlength=len(states))
 
     def add_crt(self, crt: CRT):
         """
         Add a CRT to the pool
         """
+        n = len(self.pool)
+        if n == self.ids.size:
+            # Grow geometrically to keep insertions amortized O(1)
+            self.ids = np.resize(self.ids, max(2 * n, 1))
+            self.states = np.resize(self.states, max(2 * n, 1))
+        self.ids[n] = crt.id
+        crt.bind(self, n)
+        self.counts[self.states[n]] += 1
+
         self.state_pools[crt.state].ingress(crt.id)
         self.pool.append(crt)
 
@@ -162,7 +310,4 @@ class CRTPool:
         """
         Return the number of crates in each state
         """
-        report = {}
-        for state in states:
-            report[state] = len([crt for crt in self.pool if crt.state == state])
-        return report
+        return dict(zip(states, self.counts.tolist()))
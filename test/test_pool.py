@@ -19,7 +19,8 @@ def crt_pool():
         mean_trip_duration=100,
         daily_loss_rate=.01,
         replenishment_rate=0,
-        start_date=date.today()
+        start_date=date.today(),
+        rng=np.random.default_rng(42)
     )
     # let's push the FIFO elements in the 'home' state
     for _ in range(7):
@@ -48,5 +49,47 @@ def test_crtpool_report(crt_pool):
     assert all(isinstance(count, int) for count in report.values())
 
 
+def test_crtpool_report_matches_crates(crt_pool):
+    for _ in range(50):
+        crt_pool.proceed(demand=3)
+    report = crt_pool.report()
+    for state, count in report.items():
+        assert count == len([crt for crt in crt_pool.pool if crt.state == state])
+
+
+def test_crtpool_seeded_rng_is_reproducible():
+    def simulate(seed):
+        pool = CRTPool(
+            pool_size,
+            mean_trip_duration=10,
+            daily_loss_rate=.05,
+            replenishment_rate=1,
+            start_date=date.today(),
+            rng=np.random.default_rng(seed)
+        )
+        return [pool.proceed(demand=2) for _ in range(30)]
+
+    assert simulate(0) == simulate(0)
+
+
+def test_crtpool_run(crt_pool):
+    start = crt_pool.date
+    reports = crt_pool.run(np.full(20, 2))
+    assert all(len(reports[state]) == 20 for state in ['home', 'rented', 'lost'])
+    assert {state: counts[-1] for state, counts in reports.items()} == crt_pool.report()
+    assert (crt_pool.date - start).days == 20
+
+
+def test_crtpool_proceed_until_gives_up():
+    pool = CRTPool(n_crates=1, mean_trip_duration=5, daily_loss_rate=1,
+                   replenishment_rate=0, start_date=date.today(),
+                   rng=np.random.default_rng(42))
+    # The only CRT is lost on its first trip, so it never comes back home
+    assert pool.proceed_until('lost', 0, demand=1, max_days=10)
+    start = pool.date
+    assert not pool.proceed_until('home', 0, demand=1, max_days=10)
+    assert (pool.date - start).days == 10
+
+
 if __name__ == "__main__":
     pytest.main()
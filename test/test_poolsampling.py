@@ -1,6 +1,6 @@
 import pytest
 import numpy as np
-from synthetic.pool_sampling import FIFO
+from synthetic.pool_sampling import FIFO, LogNormal
 
 
 class TestFIFO:
@@ -61,4 +61,78 @@ class TestFIFO:
         assert 2 in fifo.pool[1]
         fifo.draw(0)  # Move elements forward again
         assert 1 in fifo.pool[0]
-        assert 2 in fifo.pool[0]
\ No newline at end of file
+        assert 2 in fifo.pool[0]
+
+    def test_egress_many(self):
+        fifo = FIFO(delay=0)
+        for idx in range(1, 6):
+            fifo.ingress(idx)
+        fifo.egress_many(fifo.draw(2))
+        assert list(fifo.pool[0]) == [3, 4, 5]
+        with pytest.raises(AssertionError):
+            fifo.egress_many(np.array([4, 6]))
+
+    def test_order_across_days(self):
+        fifo = FIFO(delay=2, capacity=4)
+        for day in range(10):
+            for k in range(5):
+                fifo.ingress(10 * day + k)
+            fifo.draw(0)
+        # Elements become due in the order they came in, two days after ingress
+        due = list(fifo.pool[0])
+        assert due == [10 * day + k for day in range(9) for k in range(5)]
+        assert list(fifo.pool[1]) == [90, 91, 92, 93, 94]
+        assert len(fifo.pool[2]) == 0
+
+    def test_remove(self):
+        fifo = FIFO(delay=2)
+        for idx in [1, 2, 3]:
+            fifo.ingress(idx)
+        fifo.draw(0)
+        for idx in [4, 5, 6]:
+            fifo.ingress(idx)
+        fifo.draw(0)
+        fifo.ingress(2)
+        fifo.ingress(8)
+        fifo.ingress(2)
+        fifo.remove(2)
+        fifo.remove(5)
+        fifo.remove(7)
+        assert list(fifo.pool[0]) == [1, 3]
+        assert list(fifo.pool[1]) == [4, 6]
+        assert list(fifo.pool[2]) == [8]
+
+
+class TestLogNormal:
+
+    def test_egress_keeps_slots_consistent(self):
+        lognormal = LogNormal(mean=3, std=1)
+        for idx in range(1, 21):
+            lognormal.ingress(idx)
+        lognormal.egress(5)
+        lognormal.remove(1)
+        assert lognormal.size == 18
+        assert set(lognormal.pool) == set(range(2, 21)) - {5}
+        for idx, slot in lognormal.pool.items():
+            assert lognormal.ids[slot] == idx
+
+    def test_draw_eventually_returns_all(self):
+        lognormal = LogNormal(mean=1, std=1)
+        for idx in range(1, 11):
+            lognormal.ingress(idx)
+        drawn = set()
+        for _ in range(100):
+            for idx in lognormal.draw(None):
+                drawn.add(int(idx))
+                lognormal.egress(idx)
+        assert drawn == set(range(1, 11))
+        assert lognormal.size == 0
+
+    def test_durations_refill_cache(self):
+        lognormal = LogNormal(mean=3, std=1, rng=np.random.default_rng(0))
+        lognormal.block_size = 4
+        for idx in range(1, 11):
+            lognormal.ingress(idx)
+        expected = np.log(np.random.default_rng(0).lognormal(3, 1, size=4))
+        np.testing.assert_array_equal(lognormal.steps[:4], expected)
+        assert len(set(lognormal.steps[:10].tolist())) == 10
@@ -1,8 +1,33 @@
 from dataclasses import dataclass
 from datetime import date
 
-from synthetic.records import AutoIncrement, Registry
-from synthetic.state_machine import CRTPool
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+from pytest import fixture
+
+from synthetic.generate import write_trips, _ratio
+from synthetic.records import AutoIncrement, Registry, Trip, TripPool
+from synthetic.state_machine import CRT, CRTPool
+
+
+@fixture
+def simulated_registry():
+    """
+    Registry of the trips of a small pool simulated for 50 days
+    """
+    trips = Registry()
+    pool = CRTPool(n_crates=10,
+                   daily_loss_rate=.01,
+                   mean_trip_duration=5,
+                   replenishment_rate=0,
+                   start_date=date.today(),
+                   registry=trips,
+                   rng=np.random.default_rng(42))
+    for _ in range(50):
+        pool.proceed(demand=5)
+    return trips
 
 
 @dataclass
@@ -51,18 +76,134 @@ class TestRecords:
         crt = pool.pool[0]
 
         # Evolve until it goes to 'rented' state
-        while crt.state != 'rented':
-            pool.proceed(demand=5)
+        assert pool.proceed_until('rented', 0, demand=5)
+        assert crt.state == 'rented'
 
         # Check that a trip with this CRT is registered
-        assert crt.id in [trip.crt_id for trip in registry.registry.values()]
-        trip_id = [trip.id for trip in registry.registry.values() if trip.crt_id == crt.id][0]
+        trip_ids = registry.trips_for(crt.id)
+        assert len(trip_ids) > 0
+        trip_id = trip_ids[0]
 
         # Evolve until it goes to 'home' state
-        while crt.state != 'home':
-            pool.proceed(demand=5)
+        assert pool.proceed_until('home', 0, demand=5)
+        assert crt.state == 'home'
 
         # Check that the trip is updated
         trip = registry[trip_id]
         assert trip.states[-1][0] == 'home'
 
+    def test_dump(self, simulated_registry):
+        """
+        Test that the dump has one row per trip, and an end date only for finished trips
+        """
+        registry = simulated_registry
+        df = registry.dump()
+        assert len(df) == len(registry)
+        assert list(df.columns) == ['trip_id', 'crt_id', 'start', 'end', 'state']
+        assert df['end'].notna().equals(df['state'] == 'home')
+        assert (df.loc[df['state'] == 'home', 'end'] >= df.loc[df['state'] == 'home', 'start']).all()
+
+    def test_streaming_dump(self, simulated_registry):
+        """
+        Test that the streamed batches hold the same trips as the DataFrame dump
+        """
+        registry = simulated_registry
+        batches = list(registry.dump(streaming=True, batch_size=7))
+        assert all(batch.num_rows <= 7 for batch in batches)
+        streamed = pa.Table.from_batches(batches).to_pandas()
+        pd.testing.assert_frame_equal(streamed, registry.dump(), check_dtype=False)
+
+    def test_trip_recycling(self):
+        """
+        Test that the CRTs of a pool recycle their finished trips with a new id,
+        once the registry has recorded them
+        """
+        registry = Registry()
+        pool = CRTPool(n_crates=1,
+                       daily_loss_rate=0,
+                       mean_trip_duration=2,
+                       replenishment_rate=0,
+                       start_date=date(2024, 1, 1),
+                       registry=registry,
+                       rng=np.random.default_rng(42))
+        crt = pool.pool[0]
+        assert pool.proceed_until('rented', 0, demand=1)
+        trip = crt.trip
+        trip_id = trip.id
+        assert pool.proceed_until('home', 0, demand=1)
+        assert pool.proceed_until('rented', 0, demand=1)
+
+        assert crt.trip is trip
+        assert crt.trip.id > trip_id
+        assert registry[trip_id].states[-1][0] == 'home'
+        assert registry[crt.trip.id].states[-1][0] == 'rented'
+
+    def test_callback_trips_are_not_recycled(self):
+        """
+        Test that trips reported to any other callback stay as they were reported
+        """
+        kept = []
+        crt = CRT(created_at=date(2024, 1, 1), reporting_callback=kept.append)
+        crt.next(date(2024, 1, 1))
+        crt.next(date(2024, 1, 5))
+        CRT(created_at=date(2024, 1, 6)).next(date(2024, 1, 6))
+
+        assert kept[-1].crt_id == crt.id
+        assert kept[-1].states == [('rented', date(2024, 1, 1)), ('home', date(2024, 1, 5))]
+
+    def test_registry_grows_from_empty(self):
+        """
+        Test that the registry makes room for trips even when created without any
+        """
+        registry = Registry(capacity=0)
+        for crt_id in range(3):
+            registry.register(Trip(crt_id=crt_id, created_at=date(2024, 1, 1),
+                                   states=[('rented', date(2024, 1, 1))]))
+        assert registry.dump()['crt_id'].tolist() == [0, 1, 2]
+
+    def test_register_finished_trip_twice(self):
+        """
+        Test that registering a finished trip again doesn't hand it out for reuse
+        """
+        registry = Registry()
+        trip = Trip(crt_id=1, created_at=date(2024, 1, 1),
+                    states=[('rented', date(2024, 1, 1)), ('home', date(2024, 1, 5))])
+        registry.register(trip)
+        registry.register(trip)
+
+        trips = [TripPool.acquire(crt_id=crt_id, created_at=date(2024, 1, 6),
+                                   states=[('rented', date(2024, 1, 6))]) for crt_id in (2, 3)]
+        assert trip not in trips
+        assert trips[0] is not trips[1]
+        for new_trip in trips:
+            registry.register(new_trip)
+        assert registry.dump()['crt_id'].tolist() == [1, 2, 3]
+
+
+def test_write_trips(simulated_registry, tmp_path):
+    """
+    Test that the streamed trips are written out, along with matching summary statistics
+    """
+    target = tmp_path / "trips.parquet"
+    stats = write_trips(simulated_registry.dump(streaming=True, batch_size=7), target)
+
+    trips = pd.read_parquet(target)
+    pd.testing.assert_frame_equal(trips, simulated_registry.dump(), check_dtype=False)
+    assert stats['trips'] == len(trips)
+    for state in ['home', 'rented', 'lost']:
+        assert stats[state] == (trips['state'] == state).sum()
+    durations = (trips['end'] - trips['start']) / pd.Timedelta(days=1)
+    assert stats['duration'] == pytest.approx(durations.sum())
+
+
+def test_write_trips_empty(tmp_path):
+    """
+    Test that an empty registry is written out with zeroed statistics, and no summary ratios
+    """
+    target = tmp_path / "trips.parquet"
+    stats = write_trips(Registry().dump(streaming=True), target)
+
+    assert len(pd.read_parquet(target)) == 0
+    assert stats == {'trips': 0, 'home': 0, 'rented': 0, 'lost': 0, 'duration': 0.}
+    assert np.isnan(_ratio(stats['duration'], stats['home']))
+    assert np.isnan(_ratio(stats['lost'], stats['trips']))